@@ -4,8 +4,19 @@ This module contains functions for securely
 handling user passwords using bcrypt.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+import asyncio
+import os
+import threading
+import time
+
 import bcrypt
 
+MIN_CALIBRATED_COST = 10
+MAX_COST = 31
+_cost = int(os.getenv("BCRYPT_COST", 12))
+
 
 def hash_password(password: str) -> bytes:
     """
@@ -18,7 +29,7 @@ def hash_password(password: str) -> bytes:
     Returns:
         bytes: The salted, hashed password.
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(_cost))
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -33,3 +44,191 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
         bool: True if the passwords match, False otherwise.
     """
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+def calibrate_cost(target_ms: float = 250.0) -> int:
+    """
+    Picks the highest bcrypt cost whose hash time fits the target on
+    this machine, and uses it for every later hash.
+
+    Each extra cost step doubles the hash time, so the search stops
+    as soon as the next step would overshoot the target. A slow machine
+    never gets less than MIN_CALIBRATED_COST.
+
+    Args:
+        target_ms (float): The wanted hash latency, in milliseconds.
+
+    Returns:
+        int: The selected cost.
+    """
+    global _cost
+    sample = b"calibration-password"
+    cost = MIN_CALIBRATED_COST
+    while cost < MAX_COST:
+        start = time.perf_counter()
+        bcrypt.hashpw(sample, bcrypt.gensalt(cost))
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        if elapsed_ms * 2 > target_ms:
+            break
+        cost += 1
+    _cost = cost
+    return cost
+
+
+def get_cost(hashed_password: bytes = None) -> int:
+    """
+    Returns the cost used for new hashes, or the cost of a stored hash.
+
+    Args:
+        hashed_password (bytes): A bcrypt hash such as b"$2b$12$...".
+
+    Returns:
+        int: The bcrypt cost.
+    """
+    if hashed_password is None:
+        return _cost
+    return int(hashed_password.split(b"$")[2])
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Checks if a stored hash was made with a lower cost than the current one.
+
+    Hashes stronger than the current cost are kept, so lowering the
+    cost never weakens stored passwords.
+
+    Args:
+        hashed_password (bytes): The hashed password.
+
+    Returns:
+        bool: True if the hash should be replaced.
+    """
+    return get_cost(hashed_password) < _cost
+
+
+def verify_and_update(hashed_password: bytes,
+                      password: str) -> Tuple[bool, Optional[bytes]]:
+    """
+    Checks a password and rehashes it when its cost is outdated.
+
+    Args:
+        hashed_password (bytes): The hashed password.
+        password (str): The plain-text password.
+
+    Returns:
+        Tuple[bool, Optional[bytes]]: Whether the passwords match, and a
+        new hash to store when they do and the old cost is outdated.
+    """
+    if not is_valid(hashed_password, password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, hash_password(password)
+    return True, None
+
+
+_executor: ThreadPoolExecutor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the shared bounded thread pool used for bcrypt work.
+
+    bcrypt releases the GIL while hashing, so threads run on every core.
+    The pool size comes from BCRYPT_WORKERS and defaults to the CPU count.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.getenv("BCRYPT_WORKERS", os.cpu_count() or 1))
+            _executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="bcrypt")
+        return _executor
+
+
+def hash_passwords(passwords: Iterable[str]) -> List[bytes]:
+    """
+    Hashes many passwords concurrently.
+
+    Args:
+        passwords (Iterable[str]): The passwords to be hashed.
+
+    Returns:
+        List[bytes]: The salted, hashed passwords, in the same order.
+    """
+    return list(_get_executor().map(hash_password, passwords))
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+    """
+    Checks many passwords against their hashes concurrently.
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): (hashed_password, password)
+            pairs.
+
+    Returns:
+        List[bool]: One result per pair, in the same order.
+    """
+    return list(_get_executor().map(lambda pair: is_valid(*pair), pairs))
+
+
+async def hash_password_async(password: str) -> bytes:
+    """
+    Hashes a password without blocking the event loop.
+
+    Args:
+        password (str): The password to be hashed.
+
+    Returns:
+        bytes: The salted, hashed password.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), hash_password,
+                                      password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """
+    Checks a password without blocking the event loop.
+
+    Args:
+        hashed_password (bytes): The hashed password.
+        password (str): The plain-text password.
+
+    Returns:
+        bool: True if the passwords match, False otherwise.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), is_valid,
+                                      hashed_password, password)
+
+
+async def hash_passwords_async(passwords: Iterable[str]) -> List[bytes]:
+    """
+    Hashes many passwords concurrently without blocking the event loop.
+
+    Args:
+        passwords (Iterable[str]): The passwords to be hashed.
+
+    Returns:
+        List[bytes]: The salted, hashed passwords, in the same order.
+    """
+    return list(await asyncio.gather(
+        *(hash_password_async(password) for password in passwords)))
+
+
+async def verify_many_async(
+        pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+    """
+    Checks many passwords concurrently without blocking the event loop.
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): (hashed_password, password)
+            pairs.
+
+    Returns:
+        List[bool]: One result per pair, in the same order.
+    """
+    return list(await asyncio.gather(
+        *(is_valid_async(*pair) for pair in pairs)))
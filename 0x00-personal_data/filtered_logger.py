@@ -3,12 +3,30 @@
 Function returns the Log Messages
 """
 import re
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Callable, Dict, Iterable, Iterator, List, TextIO, Tuple
+import argparse
+import atexit
+import json
 import logging
+import logging.handlers
 import mysql.connector
 import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+USER_COLUMNS = ("name", "email", "phone", "ssn", "password", "ip",
+                "last_login", "user_agent")
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_POOL_SIZE = 5
+DEFAULT_WATERMARK_FILE = ".users_watermark.json"
 
 
 class RedactingFormatter(logging.Formatter):
@@ -30,6 +48,69 @@ class RedactingFormatter(logging.Formatter):
                             message, self.SEPARATOR)
 
 
+class JSONRedactingFormatter(RedactingFormatter):
+    """ JSON Redacting Formatter class
+
+        Records logged with extra={"data": {...}} are masked by key,
+        in nested dicts and lists too, and emitted as one JSON line
+        without any regex pass. Tracebacks and stacks are redacted like
+        the message.
+        """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Function masks the record data and serializes it"""
+        entry = {"logger": record.name, "level": record.levelname,
+                 "time": self.formatTime(record)}
+        data = getattr(record, "data", None)
+        if data is None:
+            entry["message"] = self._redact(record.getMessage())
+        else:
+            entry["data"] = self._mask(data)
+        if record.exc_info:
+            entry["exc_info"] = self._redact(
+                self.formatException(record.exc_info))
+        if record.stack_info:
+            entry["stack_info"] = self._redact(
+                self.formatStack(record.stack_info))
+        return json.dumps(entry, default=str)
+
+    def _redact(self, text: str) -> str:
+        """Function redacts the fields of a text"""
+        return filter_datum(self.fields, self.REDACTION, text,
+                            self.SEPARATOR)
+
+    def _mask(self, value):
+        """Function masks the fields of dicts, at any depth"""
+        if isinstance(value, dict):
+            return {key: self.REDACTION if key in self.fields
+                    else self._mask(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._mask(item) for item in value]
+        return value
+
+
+@lru_cache(maxsize=None)
+def _redactor(fields: Tuple[str, ...], redaction: str,
+              separator: str) -> Callable[[str], str]:
+    """
+    Build and cache a single-pass redaction function.
+
+    All fields are folded into one alternation so a message is scanned
+    once, whatever the number of fields. Each field gets a named group
+    so the replacement can be looked up from the alternative that matched.
+    """
+    if not fields:
+        return str
+    alternatives = "|".join("(?P<f{}>{})".format(index, element)
+                            for index, element in enumerate(fields))
+    pattern = re.compile("(?:{})=.*?{}".format(alternatives, separator))
+    replacements = {"f{}".format(index): "{}={}{}".format(element,
+                                                         redaction,
+                                                         separator)
+                    for index, element in enumerate(fields)}
+    return partial(pattern.sub, lambda match: replacements[match.lastgroup])
+
+
 def filter_datum(fields: List[str], redaction: str, message: str,
                  separator: str) -> str:
     """
@@ -44,35 +125,267 @@ def filter_datum(fields: List[str], redaction: str, message: str,
     Returns:
     - String: Obfuscated log message.
     """
-    for element in fields:
-        replace = "{}={}{}".format(element, redaction, separator)
-        message = re.sub("{}=.*?{}".format(element, separator),
-                         replace, message)
-    return message
+    return _redactor(tuple(fields), redaction, separator)(message)
+
+
+def filter_many(fields: List[str], redaction: str, messages: Iterable[str],
+                separator: str) -> List[str]:
+    """
+    Obfuscate specified fields in many log messages at once.
+
+    Args:
+    - fields: List of strings representing fields to obfuscate.
+    - redaction: String representing the obfuscation value.
+    - messages: Iterable of strings representing the log lines.
+    - separator: String representing the character
+    separating fields in the log lines.
+    Returns:
+    - List: Obfuscated log messages, in the same order.
+    """
+    redact = _redactor(tuple(fields), redaction, separator)
+    return [redact(message) for message in messages]
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler with an overflow policy for a bounded queue
+        """
+
+    POLICIES = ("block", "drop-oldest", "drop-newest")
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = "block"):
+        if overflow not in self.POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(self.POLICIES)))
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Function puts a record on the queue according to the policy"""
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == "drop-newest":
+                    return
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self.queue.task_done()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """ Queue listener that drains records and writes them in batches
+        """
+
+    def __init__(self, log_queue: queue.Queue, *handlers: logging.Handler,
+                 batch_size: int = 100):
+        super(BatchingQueueListener, self).__init__(
+            log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self) -> None:
+        """Function waits for room so a full queue still shuts down"""
+        self.queue.put(self._sentinel)
 
+    def handle_batch(self, records: List[logging.LogRecord]) -> None:
+        """Function formats a batch and writes it once per handler
 
-def get_logger() -> logging.Logger:
-    """Funtion returms a user data logger"""
-    logger = logging.getLogger("user_data")
-    logger.setLevel(logging.INFO)
-    logger.propagate = False
+        Errors are reported through handler.handleError, as
+        Handler.handle does, so a failing sink never stops the thread."""
+        for handler in self.handlers:
+            lines = []
+            for record in records:
+                try:
+                    if record.levelno < handler.level or \
+                            not handler.filter(record):
+                        continue
+                    if not isinstance(handler, logging.StreamHandler):
+                        handler.handle(record)
+                        continue
+                    lines.append(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+            if not lines:
+                continue
+            try:
+                with handler.lock:
+                    handler.stream.write("".join(lines))
+                    handler.flush()
+            except Exception:
+                handler.handleError(records[-1])
 
-    stream_handler = logging.StreamHandler()
-    formatter = RedactingFormatter(fields=PII_FIELDS)
-    stream_handler.setFormatter(formatter)
+    def _monitor(self) -> None:
+        """Function drains the queue on the listener thread"""
+        while True:
+            record = self.dequeue(True)
+            stop = record is self._sentinel
+            batch = [] if stop else [record]
+            taken = 1
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    batch.append(record)
+            if batch:
+                self.handle_batch(batch)
+            for _ in range(taken):
+                self.queue.task_done()
+            if stop:
+                return
 
-    logger.addHandler(stream_handler)
 
+_listeners: List[BatchingQueueListener] = []
+_loggers: Dict[str, dict] = {}
+_loggers_lock = threading.Lock()
+
+
+def stop_listeners() -> None:
+    """Function flushes and stops every background logging listener
+
+    The loggers using them are forgotten, so a later get_logger call
+    builds a new listener instead of returning a dead one."""
+    with _loggers_lock:
+        for name, entry in list(_loggers.items()):
+            if entry["listener"] is not None:
+                _release(logging.getLogger(name), entry)
+                del _loggers[name]
+        while _listeners:
+            _listeners.pop().stop()
+
+
+atexit.register(stop_listeners)
+
+
+def _release(logger: logging.Logger, entry: dict) -> None:
+    """Function detaches the handlers installed by a registry entry"""
+    for handler in entry["handlers"]:
+        logger.removeHandler(handler)
+    listener = entry["listener"]
+    if listener in _listeners:
+        _listeners.remove(listener)
+        listener.stop()
+
+
+def get_logger(queued: bool = False, queue_size: int = 10000,
+               overflow: str = "block", batch_size: int = 100,
+               name: str = "user_data", fields: Iterable[str] = None,
+               stream: TextIO = None,
+               structured: bool = False) -> logging.Logger:
+    """Funtion returms a user data logger
+
+    Loggers are cached by name: calling again with the same fields,
+    sink and options returns the configured logger without adding
+    handlers, and different options replace the previous handlers.
+    fields default to PII_FIELDS, or to the fields last given to
+    set_redacted_fields for this logger.
+
+    With structured=True, records are written as JSON lines by
+    JSONRedactingFormatter instead of the default text format.
+
+    With queued=True, records go through a bounded queue and are
+    redacted and written in batches on a background thread. overflow
+    picks what happens when the queue is full: "block" the caller,
+    "drop-oldest" or "drop-newest"."""
+    logger = logging.getLogger(name)
+    with _loggers_lock:
+        entry = _loggers.get(name)
+        override = None if entry is None else entry["override"]
+        if fields is None:
+            fields = PII_FIELDS if override is None else override
+        else:
+            override = None
+        fields = tuple(fields)
+        key = (fields, stream, queued, queue_size, overflow, batch_size,
+               structured)
+        if entry is not None and entry["key"] == key:
+            return logger
+        if entry is not None:
+            _release(logger, entry)
+
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        stream_handler = logging.StreamHandler(stream)
+        if structured:
+            formatter = JSONRedactingFormatter(fields=fields)
+        else:
+            formatter = RedactingFormatter(fields=fields)
+        stream_handler.setFormatter(formatter)
+
+        listener = None
+        if queued:
+            log_queue = queue.Queue(maxsize=queue_size)
+            listener = BatchingQueueListener(log_queue, stream_handler,
+                                             batch_size=batch_size)
+            handler = BoundedQueueHandler(log_queue, overflow)
+            listener.start()
+            _listeners.append(listener)
+        else:
+            handler = stream_handler
+        logger.addHandler(handler)
+
+        _loggers[name] = {"key": key, "formatter": formatter,
+                          "handlers": [handler], "listener": listener,
+                          "override": override}
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
+def set_redacted_fields(fields: Iterable[str],
+                        name: str = "user_data") -> None:
     """
-    Function to connect to the MySQL database using environment variables.
+    Change the redacted fields of a cached logger in place.
 
-    Returns:
-    - mysql.connector.connection.MySQLConnection: Database connector object.
+    The change lasts until get_logger is called with explicit fields:
+    calls with the default fields keep it, even when other options
+    rebuild the handlers.
+
+    Args:
+    - fields: Iterable of strings representing fields to obfuscate.
+    - name: Name of a logger built by get_logger.
     """
+    fields = tuple(fields)
+    with _loggers_lock:
+        entry = _loggers.get(name)
+        if entry is None:
+            raise KeyError("no logger named {}".format(name))
+        entry["formatter"].fields = fields
+        entry["key"] = (fields,) + entry["key"][1:]
+        entry["override"] = fields
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    """ SQLite cursor accepting the %s placeholders used with MySQL
+        """
+
+    def execute(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """Function runs a query written in the format paramstyle"""
+        return super(SQLiteCursor, self).execute(sql.replace("%s", "?"),
+                                                 parameters)
+
+
+class SQLiteConnection(sqlite3.Connection):
+    """ SQLite connection handing out SQLiteCursor objects
+        """
+
+    def cursor(self, factory: type = SQLiteCursor) -> sqlite3.Cursor:
+        """Function returns a new cursor"""
+        return super(SQLiteConnection, self).cursor(factory)
+
+
+def _connect_mysql() -> mysql.connector.connection.MySQLConnection:
+    """Function opens a MySQL connection from environment variables"""
     username: str = os.getenv("PERSONAL_DATA_DB_USERNAME", "root")
     password: str = os.getenv("PERSONAL_DATA_DB_PASSWORD", "")
     host: str = os.getenv("PERSONAL_DATA_DB_HOST", "localhost")
@@ -88,21 +401,344 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return connector
 
 
-def main():
-    """Function to retrieve all rows in the users
-    table and display each row under a filtered format."""
+def _connect_sqlite() -> SQLiteConnection:
+    """Function opens the SQLite file named by PERSONAL_DATA_DB_NAME"""
+    db_name: str = os.getenv("PERSONAL_DATA_DB_NAME", "personal_data.db")
+    return sqlite3.connect(db_name, check_same_thread=False,
+                           factory=SQLiteConnection)
+
+
+DB_BACKENDS = {"mysql": _connect_mysql, "sqlite": _connect_sqlite}
+
+
+class PooledConnection():
+    """ Connection proxy that goes back to its pool when closed
+        """
+
+    def __init__(self, pool: "ConnectionPool", connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name: str):
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """Function returns the connection to the pool"""
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
+
+
+class ConnectionPool():
+    """ Fixed-size pool of DB-API connections opened on demand
+        """
+
+    def __init__(self, connect: Callable[[], object], size: int):
+        self.connect = connect
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.in_use = 0
+        self.acquires = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self) -> PooledConnection:
+        """Function hands out an idle connection, waiting if none is left"""
+        start = time.perf_counter()
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                connection = self._idle.get()
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.in_use += 1
+            self.acquires += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return PooledConnection(self, connection)
+
+    def release(self, connection) -> None:
+        """Function puts a connection back in the idle set"""
+        with self._lock:
+            self.in_use -= 1
+        self._idle.put(connection)
+
+    def stats(self) -> dict:
+        """Function reports pool utilization and acquire latency"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "in_use": self.in_use,
+                "utilization": self.in_use / self.size,
+                "acquires": self.acquires,
+                "acquire_avg_ms": (1000 * self.wait_total / self.acquires
+                                   if self.acquires else 0.0),
+                "acquire_max_ms": 1000 * self.wait_max,
+            }
+
+
+_pool: ConnectionPool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Function returns the process-wide connection pool.
+
+    The backend comes from PERSONAL_DATA_DB_BACKEND ("mysql" or
+    "sqlite") and the size from PERSONAL_DATA_DB_POOL_SIZE. A forked
+    process gets its own pool rather than sharing its parent's sockets.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            backend = os.getenv("PERSONAL_DATA_DB_BACKEND", "mysql")
+            if backend not in DB_BACKENDS:
+                raise ValueError("unknown database backend {}".format(
+                    backend))
+            size = int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE",
+                                 DEFAULT_POOL_SIZE))
+            _pool = ConnectionPool(DB_BACKENDS[backend], size)
+        return _pool
+
+
+def pool_stats() -> dict:
+    """Function returns the statistics of the connection pool"""
+    return get_pool().stats()
+
+
+def get_db() -> PooledConnection:
+    """
+    Function to connect to the database using environment variables.
+
+    Returns:
+    - PooledConnection: Database connector object borrowed from the
+    pool; closing it gives it back.
+    """
+    return get_pool().acquire()
+
+
+def stream_rows(cursor, batch_size: int) -> Iterator[tuple]:
+    """
+    Yield rows from an executed cursor in fixed-size batches.
+
+    Args:
+    - cursor: DB-API cursor on which a query has been executed.
+    - batch_size: Number of rows to pull per fetchmany call.
+    Returns:
+    - Iterator: Rows, one at a time, holding at most one batch in memory.
+    """
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        for row in batch:
+            yield row
+
+
+def load_watermark(path: str) -> Tuple[str, str]:
+    """
+    Read the incremental export watermark.
+
+    Args:
+    - path: Path of the watermark file.
+    Returns:
+    - Tuple: (last_login, email) of the last exported row, or None.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        state = json.load(f)
+    return state["last_login"], state["email"]
+
+
+def save_watermark(path: str, last_login: str, email: str) -> None:
+    """Function atomically replaces the incremental export watermark"""
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "w") as f:
+        json.dump({"last_login": last_login, "email": email}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def incremental_rows(cursor, batch_size: int,
+                     path: str) -> Iterator[tuple]:
+    """
+    Yield the users rows changed since the stored watermark.
+
+    Rows are read in (last_login, email) order and the watermark moves
+    past a batch once all of its rows have been consumed, so an
+    interrupted run resumes after the last completed batch. Rows with
+    no last_login are only exported by the first run.
+
+    Args:
+    - cursor: DB-API cursor on the users database.
+    - batch_size: Number of rows per batch and per watermark commit.
+    - path: Path of the watermark file.
+    Returns:
+    - Iterator: Rows past the watermark.
+    """
+    watermark = load_watermark(path)
+    if watermark is None:
+        cursor.execute("SELECT * FROM users ORDER BY last_login, email;")
+    else:
+        last_login, email = watermark
+        cursor.execute("SELECT * FROM users WHERE last_login > %s OR "
+                       "(last_login = %s AND email > %s) "
+                       "ORDER BY last_login, email;",
+                       (last_login, last_login, email))
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        for row in batch:
+            yield row
+        last = batch[-1]
+        if last[6] is not None:
+            save_watermark(path, str(last[6]), last[1])
+
+
+def format_row(row: tuple) -> str:
+    """Function formats a users row as a key=value log message"""
+    fields = 'name={}; email={}; phone={}; ssn={}; password={}; ip={}; '\
+        'last_login={}; user_agent={};'
+    return fields.format(row[0], row[1], row[2], row[3],
+                         row[4], row[5], row[6], row[7])
+
+
+def _redact_rows(rows: List[tuple]) -> str:
+    """Function formats and redacts a batch of users rows into log
+    lines of the user_data logger, stamped with the batch time"""
+    redact = _redactor(PII_FIELDS, RedactingFormatter.REDACTION,
+                       RedactingFormatter.SEPARATOR)
+    record = logging.makeLogRecord({"name": "user_data", "msg": "",
+                                    "levelname": "INFO",
+                                    "levelno": logging.INFO})
+    prefix = logging.Formatter(RedactingFormatter.FORMAT).format(record)
+    return "".join([prefix + redact(format_row(row)) + "\n"
+                    for row in rows])
+
+
+def parallel_chunks(workers: int,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE
+                    ) -> Iterator[Tuple[int, str]]:
+    """
+    Redact the users table across a pool of worker processes.
+
+    The table is read once, in batches of chunk_size rows, and each
+    batch is redacted by a worker into one block of log lines. At most
+    two batches per worker are in flight, so memory stays bounded
+    whatever the size of the table.
+
+    Args:
+    - workers: Number of worker processes.
+    - chunk_size: Number of rows redacted per task.
+    Returns:
+    - Iterator: (row count, log lines) of each batch in table order.
+    """
     my_db = get_db()
     cursor = my_db.cursor()
     cursor.execute("SELECT * FROM users;")
-    data = cursor.fetchall()
-
-    log = get_logger()
-
-    for row in data:
-        fields = 'name={}; email={}; phone={}; ssn={}; password={}; ip={}; '\
-            'last_login={}; user_agent={};'
-        fields = fields.format(row[0], row[1], row[2], row[3],
-                               row[4], row[5], row[6], row[7])
-        log.info(fields)
-    cursor.close()
-    my_db.close()
+    pending = deque()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if rows:
+                    pending.append((len(rows),
+                                    executor.submit(_redact_rows, rows)))
+                if pending and (not rows or len(pending) >= 2 * workers):
+                    count, future = pending.popleft()
+                    yield count, future.result()
+                elif not rows:
+                    return
+    finally:
+        cursor.close()
+        my_db.close()
+
+
+def main(batch_size: int = None, workers: int = 1, structured: bool = False,
+         incremental: bool = False):
+    """Function to retrieve all rows in the users
+    table and display each row under a filtered format.
+
+    Rows are streamed from an unbuffered cursor in batches of
+    PERSONAL_DATA_BATCH_SIZE rows, so memory stays flat whatever
+    the size of the table. With several workers, rows are redacted
+    by a process pool and written to stderr in table order, a batch
+    at a time, in the format of the user_data logger. With structured=True,
+    rows are attached to the records and logged as JSON lines. With
+    incremental=True, only rows whose last_login is past the watermark
+    kept in PERSONAL_DATA_WATERMARK_FILE are exported."""
+    if batch_size is None:
+        batch_size = int(os.getenv("PERSONAL_DATA_BATCH_SIZE",
+                                   DEFAULT_BATCH_SIZE))
+    count = 0
+    start = time.perf_counter()
+    if workers > 1:
+        for rows, lines in parallel_chunks(workers):
+            sys.stderr.write(lines)
+            count += rows
+        sys.stderr.flush()
+    else:
+        log = get_logger(structured=structured)
+        my_db = get_db()
+        cursor = my_db.cursor()
+        if incremental:
+            messages = incremental_rows(
+                cursor, batch_size,
+                os.getenv("PERSONAL_DATA_WATERMARK_FILE",
+                          DEFAULT_WATERMARK_FILE))
+        else:
+            cursor.execute("SELECT * FROM users;")
+            messages = stream_rows(cursor, batch_size)
+        if not structured:
+            messages = map(format_row, messages)
+        for message in messages:
+            if structured:
+                log.info("user", extra={"data": dict(zip(USER_COLUMNS,
+                                                         message))})
+            else:
+                log.info(message)
+            count += 1
+        cursor.close()
+        my_db.close()
+    elapsed = time.perf_counter() - start
+    print("Exported {} rows in {:.2f}s ({:.0f} rows/s)".format(
+        count, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Log the users table with PII fields redacted")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="rows fetched per batch when streaming")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="redact with a pool of worker processes")
+    parser.add_argument("--json", action="store_true",
+                        help="log each row as a JSON line")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only log rows changed since the last run")
+    args = parser.parse_args()
+    if args.json and args.workers > 1:
+        parser.error("--json cannot be combined with --workers")
+    if args.incremental and args.workers > 1:
+        parser.error("--incremental cannot be combined with --workers")
+    main(args.batch_size, args.workers, args.json, args.incremental)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Scrub PII from existing log files with the filter_datum rules
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
+import argparse
+import mmap
+import os
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def chunks(data: mmap.mmap, chunk_size: int) -> Iterator[bytes]:
+    """
+    Split a mapped file into chunks that end on a line boundary.
+
+    Args:
+    - data: Memory-mapped file content.
+    - chunk_size: Approximate size of each chunk, in bytes.
+    Returns:
+    - Iterator: Chunks holding whole records only.
+    """
+    start = 0
+    size = len(data)
+    while start < size:
+        end = data.find(b"\n", min(start + chunk_size, size) - 1)
+        end = size if end == -1 else end + 1
+        yield data[start:end]
+        start = end
+
+
+def redact_file(source: str, destination: str, fields: List[str],
+                separator: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Write a redacted copy of a log file.
+
+    A match never spans a newline, so a whole chunk is redacted in one
+    call with the same result as redacting it line by line.
+
+    Args:
+    - source: Path of the log file to scrub.
+    - destination: Path of the redacted copy.
+    - fields: List of strings representing fields to obfuscate.
+    - separator: String separating fields in the log lines.
+    - chunk_size: Approximate number of bytes redacted at once.
+    Returns:
+    - int: Number of bytes read.
+    Raises:
+    - ValueError: If destination is the source file itself.
+    """
+    if os.path.realpath(destination) == os.path.realpath(source):
+        raise ValueError("refusing to overwrite {} in place".format(source))
+    with open(source, "rb") as f, \
+            open(destination, "wb", buffering=WRITE_BUFFER_SIZE) as out:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for chunk in chunks(data, chunk_size):
+                text = chunk.decode("utf-8", "surrogateescape")
+                text = filter_datum(fields, RedactingFormatter.REDACTION,
+                                    text, separator)
+                out.write(text.encode("utf-8", "surrogateescape"))
+        return size
+
+
+def main():
+    """Function parses the command line and redacts every file"""
+    parser = argparse.ArgumentParser(
+        description="Redact PII fields from existing log files")
+    parser.add_argument("files", nargs="+", help="log files to scrub")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="directory of the redacted copies "
+                             "(default: next to each file, as .redacted)")
+    parser.add_argument("--fields", default=",".join(PII_FIELDS),
+                        help="comma separated fields to redact")
+    parser.add_argument("--separator", default=RedactingFormatter.SEPARATOR,
+                        help="field separator of the log lines")
+    parser.add_argument("--chunk-size", type=int,
+                        default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                        help="chunk size in MiB")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of files processed concurrently")
+    args = parser.parse_args()
+
+    fields = [field for field in args.fields.split(",") if field]
+    destinations = []
+    for source in args.files:
+        if args.output_dir is None:
+            destinations.append(source + ".redacted")
+        else:
+            destinations.append(os.path.join(args.output_dir,
+                                             os.path.basename(source)))
+    for source, destination in zip(args.files, destinations):
+        if os.path.realpath(destination) == os.path.realpath(source):
+            parser.error("{} would be overwritten by its redacted copy"
+                         .format(source))
+    if len(set(map(os.path.realpath, destinations))) < len(destinations):
+        parser.error("several files would be redacted to the same path")
+    chunk_size = args.chunk_size * 1024 * 1024
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(redact_file, source, destination, fields,
+                                   args.separator, chunk_size)
+                   for source, destination in zip(args.files, destinations)]
+        for source, future in zip(args.files, futures):
+            print("{}: {} bytes".format(source, future.result()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark the throughput of filter_datum, RedactingFormatter.format
+and logger.info on synthetic log lines, and write the results as JSON
+"""
+from itertools import product
+from typing import List
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import string
+import sys
+import time
+
+from filtered_logger import (PII_FIELDS, RedactingFormatter, filter_datum,
+                             get_logger)
+
+FIELD_COUNTS = (4, 8, 16)
+VALUE_LENGTHS = (8, 32, 128)
+SEPARATORS = (";", ",", "&")
+PII_COUNTS = (0, 2, 5)
+
+
+def make_lines(count: int, fields: int, value_length: int, separator: str,
+               pii: int, seed: int = 0) -> List[str]:
+    """
+    Build synthetic key=value log lines.
+
+    Args:
+    - count: Number of lines to build.
+    - fields: Number of key=value pairs per line.
+    - value_length: Number of characters in each value.
+    - separator: String separating the pairs.
+    - pii: Number of pairs whose key is one of PII_FIELDS.
+    - seed: Seed of the random generator, for repeatable runs.
+    Returns:
+    - List: The log lines.
+    """
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    keys = list(PII_FIELDS[:pii]) + ["field{}".format(index)
+                                     for index in range(fields - pii)]
+    lines = []
+    for _ in range(count):
+        rng.shuffle(keys)
+        lines.append("".join("{}={}{}".format(
+            key, "".join(rng.choice(alphabet) for _ in range(value_length)),
+            separator) for key in keys))
+    return lines
+
+
+def measure(func, lines: List[str], repeat: int) -> dict:
+    """
+    Time func over every line and keep the best of several rounds.
+
+    Args:
+    - func: Callable taking one line.
+    - lines: Lines to process.
+    - repeat: Number of rounds.
+    Returns:
+    - dict: lines/s and bytes/s of the fastest round.
+    """
+    size = sum(len(line.encode()) for line in lines)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        best = min(best, time.perf_counter() - start)
+    return {"lines_per_sec": len(lines) / best, "bytes_per_sec": size / best}
+
+
+def run_case(fields: int, value_length: int, separator: str, pii: int,
+             lines_count: int, repeat: int) -> dict:
+    """Function benchmarks the three redaction paths on one line shape"""
+    lines = make_lines(lines_count, fields, value_length, separator, pii)
+    formatter = RedactingFormatter(fields=PII_FIELDS)
+    formatter.SEPARATOR = separator
+    records = {line: logging.LogRecord("user_data", logging.INFO, __file__,
+                                       0, line, None, None)
+               for line in lines}
+    with open(os.devnull, "w") as sink:
+        logger = get_logger(name="redaction_benchmark", stream=sink)
+        logger.handlers[0].formatter.SEPARATOR = separator
+        return {
+            "fields": fields,
+            "value_length": value_length,
+            "separator": separator,
+            "pii_fields": pii,
+            "line_bytes": len(lines[0].encode()),
+            "filter_datum": measure(
+                lambda line: filter_datum(PII_FIELDS, "***", line,
+                                          separator), lines, repeat),
+            "formatter": measure(
+                lambda line: formatter.format(records[line]), lines, repeat),
+            "logger_info": measure(logger.info, lines, repeat),
+        }
+
+
+def main():
+    """Function runs every case and writes the JSON report"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the PII redaction of filtered_logger")
+    parser.add_argument("--lines", type=int, default=2000,
+                        help="lines per case")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="rounds per measurement, the best is kept")
+    parser.add_argument("--output", default="-",
+                        help="JSON report path, - for stdout")
+    args = parser.parse_args()
+
+    cases = [run_case(fields, value_length, separator, pii,
+                      args.lines, args.repeat)
+             for fields, value_length, separator, pii in product(
+                 FIELD_COUNTS, VALUE_LENGTHS, SEPARATORS, PII_COUNTS)
+             if pii <= fields]
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "lines": args.lines,
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
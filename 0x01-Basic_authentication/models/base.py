@@ -1,40 +1,351 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from functools import lru_cache
+from glob import glob
+from itertools import islice
+from operator import attrgetter
+from typing import (TypeVar, List, Iterable, Iterator, TextIO, Tuple,
+                    Callable)
+from os import getenv, path
+import atexit
+import fcntl
 import json
+import operator
+import os
+import re
+import threading
 import uuid
+import zlib
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+_file_lock = threading.RLock()
+_flock_depths = {}
+
+
+class ReadWriteLock():
+    """ Lock shared by any number of readers or held by one writer;
+    a waiting writer holds back new readers so it is not starved.
+    Not reentrant: a holder must not acquire it again.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked ReadWriteLock
+        """
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        """ Hold the lock as one of the readers
+        """
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        """ Hold the lock alone
+        """
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+STORE_LOCK = ReadWriteLock()
+
+
+def journal_enabled() -> bool:
+    """ Mutations are appended to a journal when DB_JOURNAL is set
+    """
+    return getenv("DB_JOURNAL", "0") not in ("", "0")
+
+
+def write_behind_enabled() -> bool:
+    """ Files are flushed in the background when DB_WRITE_BEHIND is set,
+    unless they are shared between processes
+    """
+    return getenv("DB_WRITE_BEHIND", "0") not in ("", "0") and \
+        not shared_enabled()
+
+
+def shared_enabled() -> bool:
+    """ Files are shared between processes when DB_SHARED is set
+    """
+    return getenv("DB_SHARED", "0") not in ("", "0")
+
+
+@contextmanager
+def locked_files(s_class: str):
+    """ Hold the files of a class: the process-wide file lock and, when
+    they are shared, an exclusive flock on .db_<class>.lock. Reentrant
+    for the thread holding it.
+    """
+    with _file_lock:
+        if not shared_enabled() or _flock_depths.get(s_class):
+            _flock_depths[s_class] = _flock_depths.get(s_class, 0) + 1
+            try:
+                yield
+            finally:
+                _flock_depths[s_class] -= 1
+            return
+        with open(".db_{}.lock".format(s_class), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _flock_depths[s_class] = 1
+            try:
+                yield
+            finally:
+                _flock_depths[s_class] = 0
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def shard_count() -> int:
+    """ Number of snapshot files per class, from DB_SHARDS
+    """
+    return max(1, int(getenv("DB_SHARDS", "1")))
+
+
+def shard_of(obj_id: str, count: int) -> int:
+    """ Return the shard holding an object ID
+    """
+    return zlib.crc32(obj_id.encode()) % count
+
+
+def shard_path(s_class: str, shard: int, count: int) -> str:
+    """ Return the snapshot file of one shard; a single shard keeps the
+    historical .db_<class>.json name
+    """
+    if count == 1:
+        return ".db_{}.json".format(s_class)
+    return ".db_{}.{}-of-{}.json".format(s_class, shard, count)
+
+
+def foreign_shard_files(s_class: str, count: int) -> List[str]:
+    """ Return the snapshot files of a class written for another number
+    of shards than count
+    """
+    current = {shard_path(s_class, shard, count) for shard in range(count)}
+    paths = [".db_{}.json".format(s_class)]
+    paths += glob(".db_{}.*-of-*.json".format(s_class))
+    return sorted(file_path for file_path in paths
+                  if file_path not in current and path.exists(file_path))
+
+
+def file_state(s_class: str) -> Tuple[tuple, int]:
+    """ Return what identifies the files of a class on disk: the inode,
+    mtime and size of each snapshot shard, and the size of the journal
+    """
+    count = shard_count()
+    snapshot = []
+    for shard in range(count):
+        try:
+            stat = os.stat(shard_path(s_class, shard, count))
+            snapshot.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            snapshot.append(None)
+    snapshot = tuple(snapshot)
+    try:
+        journal = os.stat(".db_{}.journal".format(s_class)).st_size
+    except FileNotFoundError:
+        journal = 0
+    return snapshot, journal
+
+
+QUERY_OPERATORS = {
+    "eq": operator.eq,
+    "in": lambda value, param: value in param,
+    "prefix": lambda value, param: type(value) is str and
+    value.startswith(param),
+    "suffix": lambda value, param: type(value) is str and
+    value.endswith(param),
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+RANGE_OPERATORS = ("prefix", "gt", "gte", "lt", "lte")
+
+
+def parse_query(cls, where: dict) -> Tuple[tuple, tuple]:
+    """ Split a query into its shape, the sorted (attribute, operator)
+    pairs, and the parameters in the same order
+
+    A value is compared for equality, unless it is a dict mapping
+    operators of QUERY_OPERATORS to their parameter.
+    """
+    predicates = []
+    for attr, condition in where.items():
+        if attr not in cls._attributes:
+            raise AttributeError("'{}' object has no attribute '{}'"
+                                 .format(cls.__name__, attr))
+        if type(condition) is not dict:
+            predicates.append(((attr, "eq"), condition))
+            continue
+        for op, param in condition.items():
+            if op not in QUERY_OPERATORS:
+                raise ValueError("Unknown query operator: {}".format(op))
+            if op == "in":
+                param = tuple(param)
+            predicates.append(((attr, op), param))
+    predicates.sort(key=lambda predicate: predicate[0])
+    return (tuple(predicate[0] for predicate in predicates),
+            tuple(predicate[1] for predicate in predicates))
+
+
+def lookup_set(values: tuple):
+    """ Return the values of an "in" predicate as a frozenset when they
+    are hashable, for constant time membership tests
+    """
+    try:
+        return frozenset(values)
+    except TypeError:
+        return values
+
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, with a fast path for the
+    fixed-width form written by to_json
+    """
+    if len(value) == 19 and value[10] == "T":
+        return datetime.fromisoformat(value)
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def iter_json_items(f: TextIO,
+                    chunk_size: int = 1 << 16) -> Iterator[Tuple[str, dict]]:
+    """ Yield the (key, value) pairs of a top-level JSON object, reading
+    the file by chunks so only one entry is decoded at a time; values
+    may be of any JSON type
+    """
+    buf, pos, eof = "", 0, False
+    state = "{"
+    while True:
+        pos = _whitespace.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unexpected end of JSON file")
+            buf, pos = f.read(chunk_size), 0
+            eof = buf == ""
+            continue
+        char = buf[pos]
+        if state in ("{", ":"):
+            if char != state:
+                raise ValueError("Expected '{}' at {}".format(state, pos))
+            pos += 1
+            state = "key" if state == "{" else "value"
+        elif state == "," and char == ",":
+            pos += 1
+            state = "key"
+        elif char == "}" and state in ("key", ","):
+            return
+        elif state in ("key", "value"):
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            if end is not None and not eof and char not in '"[{':
+                # a number is only whole once "," or "}" follows it: the
+                # buffer may end inside it, as in 12 of 12345 or -1. of -1.5
+                after = _whitespace.match(buf, end).end()
+                if after == len(buf) or buf[after] not in ",}":
+                    end = None
+            if end is None:
+                chunk = f.read(chunk_size)
+                buf, pos, eof = buf[pos:] + chunk, 0, chunk == ""
+                continue
+            pos = end
+            if state == "key":
+                key, state = item, ":"
+            else:
+                yield key, item
+                state = ","
+        else:
+            raise ValueError("Unexpected '{}' at {}".format(char, pos))
 
 
 class Base():
     """ Base class
     """
 
+    __slots__ = ('id', '_created_at', '_updated_at', '_cache')
+    _attributes = ('id', 'created_at', 'updated_at')
+    _indexes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
+    @property
+    def created_at(self) -> datetime:
+        """ Creation date, kept as microseconds since the epoch
+        """
+        if self._created_at is None:
+            return None
+        return EPOCH + timedelta(microseconds=self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation date
+        """
+        self._created_at = None if value is None else \
+            (value - EPOCH) // MICROSECOND
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Update date, kept as microseconds since the epoch
+        """
+        if self._updated_at is None:
+            return None
+        return EPOCH + timedelta(microseconds=self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the update date
+        """
+        self._updated_at = None if value is None else \
+            (value - EPOCH) // MICROSECOND
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -44,94 +355,708 @@ class Base():
             return False
         return (self.id == other.id)
 
-    def to_json(self, for_serialization: bool = False) -> dict:
-        """ Convert the object a JSON dictionary
+    def __setattr__(self, name: str, value):
+        """ Set an attribute and drop the cached JSON string
+        """
+        object.__setattr__(self, name, value)
+        if name != '_cache':
+            object.__setattr__(self, '_cache', None)
+
+    def _serialized(self, for_serialization: bool) -> dict:
+        """ JSON dictionary of the object, built on each call so that
+        persisting the store keeps nothing per object
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key in self._attributes:
             if not for_serialization and key[0] == '_':
                 continue
+            value = getattr(self, key)
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
             else:
                 result[key] = value
         return result
 
+    def to_json(self, for_serialization: bool = False) -> dict:
+        """ Convert the object a JSON dictionary
+        """
+        return self._serialized(for_serialization)
+
+    def to_json_string(self) -> str:
+        """ Convert the object to a JSON string, encoded like jsonify
+
+        The string is cached until an attribute is set, so unchanged
+        objects are not encoded again when listing users.
+        """
+        if self._cache is None:
+            object.__setattr__(self, '_cache', json.dumps(
+                self._serialized(False), sort_keys=True,
+                separators=(",", ":")))
+        return self._cache
+
+    @classmethod
+    def all(cls) -> Iterable[TypeVar('Base')]:
+        """ Return all objects
+        """
+        return cls.search()
+
+    @classmethod
+    def sorted_ids(cls) -> List[str]:
+        """ Return the IDs of all objects in order; the list must not be
+        modified
+        """
+        return get_engine().sorted_ids(cls)
+
+    @classmethod
+    def sync(cls):
+        """ Catch up with the changes written by other processes
+        """
+        get_engine().sync(cls)
+
+    @classmethod
+    def compact(cls):
+        """ Fold pending changes into the storage files
+        """
+        get_engine().compact(cls)
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        get_engine().load(cls)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
-
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        get_engine().save_all(cls)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self._cache = None
+        get_engine().save(self)
+
+    @classmethod
+    def save_many(cls, objs: List[TypeVar('Base')]):
+        """ Save many objects of the class, persisted once
+        """
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+            obj._cache = None
+        if objs:
+            get_engine().save_many(cls, objs)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        get_engine().remove(self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return get_engine().count(cls)
 
     @classmethod
-    def all(cls) -> Iterable[TypeVar('Base')]:
-        """ Return all objects
+    def page(cls, limit: int,
+             cursor: str = None) -> Tuple[List[TypeVar('Base')], str]:
+        """ Return up to limit objects ordered by ID, starting after the
+        cursor, and the cursor of the next page (None on the last page)
         """
-        return cls.search()
+        return get_engine().page(cls, limit, cursor)
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return get_engine().get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
+        return list(cls.query(attributes))
+
+    @classmethod
+    def query(cls, where: dict = {}, limit: int = None,
+              offset: int = 0) -> Iterator[TypeVar('Base')]:
+        """ Iterate lazily over the objects matching where, in ID order
+
+        where maps an attribute to a value to compare for equality, or
+        to a dict of operators: in, prefix, suffix, gt, gte, lt and lte,
+        e.g. {"email": {"suffix": "@example.com"}}.
+        """
+        if (limit is not None and limit < 0) or offset < 0:
+            raise ValueError("limit and offset must not be negative")
+        return get_engine().query(cls, where, limit, offset)
+
+
+@lru_cache(maxsize=256)
+def compile_matcher(shape: tuple) -> Callable:
+    """ Compile the predicates of a query shape into one function of an
+    object and the parameters
+    """
+    checks = tuple((attrgetter(attr), QUERY_OPERATORS[op], position)
+                   for position, (attr, op) in enumerate(shape))
+
+    def match(obj, params: tuple) -> bool:
+        for get, test, position in checks:
+            try:
+                if not test(get(obj), params[position]):
                     return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+            except TypeError:
+                return False
+        return True
+
+    return match
+
+
+@lru_cache(maxsize=256)
+def compile_query(cls, shape: tuple) -> Tuple[str, tuple, Callable]:
+    """ Compile a query shape once: the attribute answered from a
+    secondary index (None for a scan), the positions of its predicates
+    and the matcher of every predicate
+
+    The indexed predicates are matched again since candidates are read
+    after the lock is released, when a save may have replaced them.
+    """
+    index_attr, index_positions, best = None, (), 3
+    for position, (attr, op) in enumerate(shape):
+        if attr not in cls._indexes or op == "suffix":
+            continue
+        rank = 2 if op in RANGE_OPERATORS else ("eq", "in").index(op)
+        if rank < best:
+            best, index_attr = rank, attr
+            index_positions = (position,)
+        elif rank == best == 2 and attr == index_attr:
+            index_positions += (position,)
+
+    return index_attr, index_positions, compile_matcher(shape)
+
+
+class ClassStore():
+    """ Objects of one class kept by JSONEngine, with their secondary
+    indexes, their shards and the state of the files they were read from
+    """
+
+    __slots__ = ('objs', 'indexes', 'indexed_values', 'shards',
+                 'sorted_ids', 'sorted_keys', 'file_state', 'journal_size')
+
+    def __init__(self, cls, shards: int):
+        """ Initialize an empty store for cls, split into shards
+        """
+        self.objs = {}
+        self.indexes = {attr: {} for attr in cls._indexes}
+        self.indexed_values = {}
+        self.shards = [{} for _ in range(shards)]
+        self.sorted_ids = None
+        self.sorted_keys = {}
+        self.file_state = None
+        self.journal_size = 0
+
+    def add(self, obj: Base):
+        """ Add or replace an object, in its shard and in the indexes
+        """
+        if obj.id not in self.objs:
+            self.sorted_ids = None
+        self.objs[obj.id] = obj
+        self.shards[shard_of(obj.id, len(self.shards))][obj.id] = obj
+        if not self.indexes:
+            return
+        self._unindex(obj.id)
+        values = {}
+        for attr, index in self.indexes.items():
+            value = getattr(obj, attr, None)
+            try:
+                bucket = index.get(value)
+            except TypeError:
+                continue
+            if bucket is None:
+                bucket = index[value] = {}
+                self.sorted_keys.pop(attr, None)
+            bucket[obj.id] = obj
+            values[attr] = value
+        self.indexed_values[obj.id] = values
+
+    def discard(self, obj_id: str) -> Base:
+        """ Remove an object by ID, return it or None if it is unknown
+        """
+        obj = self.objs.pop(obj_id, None)
+        if obj is None:
+            return None
+        self.sorted_ids = None
+        self.shards[shard_of(obj_id, len(self.shards))].pop(obj_id, None)
+        self._unindex(obj_id)
+        return obj
+
+    def _unindex(self, obj_id: str):
+        """ Remove an object from the secondary indexes
+        """
+        values = self.indexed_values.pop(obj_id, None)
+        if values is None:
+            return
+        for attr, value in values.items():
+            bucket = self.indexes[attr].get(value)
+            if bucket is not None:
+                bucket.pop(obj_id, None)
+                if not bucket:
+                    del self.indexes[attr][value]
+                    self.sorted_keys.pop(attr, None)
+
+    def ids(self) -> List[str]:
+        """ Return the IDs in order, built once per change of membership;
+        the list is never modified after it is returned
+        """
+        ids = self.sorted_ids
+        if ids is None:
+            ids = self.sorted_ids = sorted(self.objs)
+        return ids
+
+    def keys(self, attr: str) -> List:
+        """ Return the values of a secondary index in order, built once
+        per change of its values; None when they can't be ordered
+        """
+        keys = self.sorted_keys.get(attr)
+        if keys is None:
+            try:
+                keys = sorted(key for key in self.indexes[attr]
+                              if key is not None)
+            except TypeError:
+                keys = False
+            self.sorted_keys[attr] = keys
+        return keys if keys is not False else None
+
+
+class JSONEngine():
+    """ Storage engine keeping every object in memory and persisting them
+    to .db_<class>.json, optionally through the journal, write-behind
+    and shared modes
+    """
+
+    def __init__(self):
+        """ Initialize an engine with no class loaded
+
+        The writer lock serializes saves, removals and reloads; it is
+        always taken before the file locks.
+        """
+        self._stores = {}
+        self._writer_lock = threading.RLock()
+        self._dirty = {}
+        self._dirty_cond = threading.Condition()
+        self._flusher = None
+
+    def _store(self, cls) -> ClassStore:
+        """ Return the store of a class, empty if it was never loaded
+        """
+        store = self._stores.get(cls.__name__)
+        if store is None:
+            store = self._stores.setdefault(
+                cls.__name__, ClassStore(cls, shard_count()))
+        return store
+
+    def load(self, cls):
+        """ Load all objects from file, then replay the journal
+
+        Entries are decoded and turned into objects one at a time, so
+        the whole file is never held as a dict. Shards are read by a
+        pool of threads. The new store is built aside and swapped in
+        once complete: readers keep the previous one meanwhile, and
+        writers wait on the writer lock. Files left by another DB_SHARDS
+        raise a ValueError rather than loading an empty store.
+        """
+        s_class = cls.__name__
+        count = shard_count()
+        with self._writer_lock, locked_files(s_class):
+            foreign = foreign_shard_files(s_class, count)
+            if foreign:
+                raise ValueError(
+                    "{} written for another DB_SHARDS than {}: run "
+                    "python3 -m models.migrate_shards {} {}".format(
+                        ", ".join(foreign), count, s_class, count))
+            store = ClassStore(cls, count)
+            store.file_state = (file_state(s_class)[0], 0)
+            for objs in self._read_shards(cls, range(count), count):
+                for obj in objs:
+                    store.add(obj)
+            self._replay_journal(cls, store)
+            with STORE_LOCK.writing():
+                self._stores[s_class] = store
+
+    def _read_shards(self, cls, shards: List[int],
+                     count: int) -> Iterator[List[Base]]:
+        """ Read the objects of snapshot shards with a pool of threads,
+        in the order of shards
+        """
+        s_class = cls.__name__
+
+        def _read_shard(shard: int) -> List[Base]:
+            file_path = shard_path(s_class, shard, count)
+            if not path.exists(file_path):
+                return []
+            with open(file_path, 'r') as f:
+                return [cls(**obj_json) for _, obj_json in iter_json_items(f)]
+
+        with ThreadPoolExecutor(max_workers=max(1, len(shards))) as executor:
+            yield from executor.map(_read_shard, shards)
+
+    def _reload_shards(self, cls, store: ClassStore, shards: List[int],
+                       snapshot: tuple):
+        """ Replace the objects of the given shards of a store by those on
+        file, then replay the whole journal over the store
+
+        The shards are read before taking the store lock, so readers only
+        wait for the swap. Journal records set or remove whole objects,
+        so replaying those already applied leaves the other shards as
+        they are.
+        """
+        count = len(store.shards)
+        loaded = list(self._read_shards(cls, shards, count))
+        with STORE_LOCK.writing():
+            for shard, objs in zip(shards, loaded):
+                kept = {obj.id for obj in objs}
+                for obj_id in [obj_id for obj_id in store.shards[shard]
+                               if obj_id not in kept]:
+                    store.discard(obj_id)
+                for obj in objs:
+                    store.add(obj)
+            store.file_state = (snapshot, 0)
+            store.journal_size = 0
+            self._replay_journal(cls, store)
+
+    def _replay_journal(self, cls, store: ClassStore):
+        """ Apply the journal records past the last replayed offset on top
+        of the objects of a store
+
+        A torn final record, left by a crash in the middle of an
+        append, is dropped and cut from the journal.
+        """
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        if not path.exists(journal_path):
+            return
+
+        snapshot, offset = store.file_state or (None, 0)
+        valid_size = offset
+        with open(journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("op") == "save":
+                    store.add(cls(**record["obj"]))
+                else:
+                    store.discard(record.get("id"))
+                valid_size += len(line)
+                store.journal_size += 1
+        store.file_state = (snapshot, valid_size)
+        if valid_size != path.getsize(journal_path):
+            os.truncate(journal_path, valid_size)
+
+    def _append_journal(self, cls, records: List[dict]):
+        """ Append mutations to the journal in one write, compacting when
+        it is long
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with locked_files(s_class):
+            with open(journal_path, 'a') as f:
+                f.write(lines)
+            store = self._store(cls)
+            snapshot, offset = store.file_state or (None, 0)
+            store.file_state = (snapshot, offset + len(lines.encode()))
+            store.journal_size += len(records)
+            if store.journal_size >= int(getenv("DB_JOURNAL_COMPACT",
+                                                "1000")):
+                self.compact(cls)
+
+    def compact(self, cls):
+        """ Fold the journal into a new snapshot file
+        """
+        self.save_all(cls)
+
+    def sync(self, cls):
+        """ Catch up with the changes written by other processes
+
+        Only used when DB_SHARED is set. Unchanged files cost a stat call
+        per file; new journal records are replayed alone, and only the
+        snapshot shards whose inode, mtime or size changed are read
+        again.
+        """
+        if not shared_enabled():
+            return
+        s_class = cls.__name__
+        if self._store(cls).file_state == file_state(s_class):
+            return
+        with self._writer_lock, locked_files(s_class):
+            store = self._store(cls)
+            known = store.file_state
+            snapshot, journal = file_state(s_class)
+            if known is None or known[0] is None or \
+                    len(known[0]) != len(snapshot) or \
+                    len(store.shards) != len(snapshot):
+                self.load(cls)
+                return
+            changed = [shard for shard, state in enumerate(snapshot)
+                       if state != known[0][shard]]
+            if changed or journal < known[1]:
+                self._reload_shards(cls, store, changed, snapshot)
+            elif journal > known[1]:
+                with STORE_LOCK.writing():
+                    self._replay_journal(cls, store)
+
+    def _persist(self, cls, op: str, objs: List[Base]):
+        """ Persist mutations: journal append, deferred flush or a write
+        of the touched shards, depending on the configured mode
+        """
+        if journal_enabled():
+            records = []
+            for obj in objs:
+                record = {"op": op, "id": obj.id}
+                if op == "save":
+                    record["obj"] = obj._serialized(True)
+                records.append(record)
+            self._append_journal(cls, records)
+        elif write_behind_enabled():
+            self._mark_dirty(cls, len(objs))
+        else:
+            count = len(self._store(cls).shards)
+            touched = {shard_of(obj.id, count) for obj in objs}
+            if len(touched) == count:
+                self.save_all(cls)
+            else:
+                for shard in sorted(touched):
+                    self.save_all(cls, shard)
+
+    def flush(self):
+        """ Write the file of every class changed since the last flush
+        """
+        with _file_lock:
+            with self._dirty_cond:
+                classes = [cls for cls, _ in self._dirty.values()]
+                self._dirty.clear()
+            for cls in classes:
+                self.save_all(cls)
+
+    def _flush_loop(self):
+        """ Background thread flushing every DB_FLUSH_INTERVAL seconds, or
+        sooner once DB_FLUSH_THRESHOLD changes are pending
+        """
+        interval = float(getenv("DB_FLUSH_INTERVAL", "1.0"))
+        while True:
+            with self._dirty_cond:
+                self._dirty_cond.wait(interval)
+            self.flush()
+
+    def _mark_dirty(self, cls, changes: int = 1):
+        """ Schedule a write of the file of cls
+        """
+        s_class = cls.__name__
+        with self._dirty_cond:
+            count = self._dirty.get(s_class, (cls, 0))[1] + changes
+            self._dirty[s_class] = (cls, count)
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, daemon=True, name="models-flush")
+                self._flusher.start()
+            if count >= int(getenv("DB_FLUSH_THRESHOLD", "100")):
+                self._dirty_cond.notify()
+
+    def save_all(self, cls, shard: int = None):
+        """ Save all objects to file, or only the objects of one shard
+
+        The journal is folded in: a full snapshot empties it, and a
+        shard is only written alone when the journal is empty, so older
+        journal records are never replayed over newer snapshots.
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with locked_files(s_class):
+            store = self._store(cls)
+            count = len(store.shards)
+            journal = path.exists(journal_path) and \
+                path.getsize(journal_path) > 0
+            if journal:
+                shard = None
+            for index in range(count) if shard is None else [shard]:
+                with STORE_LOCK.reading():
+                    objs_json = {}
+                    for obj_id, obj in store.shards[index].items():
+                        objs_json[obj_id] = obj._serialized(True)
+
+                file_path = shard_path(s_class, index, count)
+                tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+                with open(tmp_path, 'w') as f:
+                    json.dump(objs_json, f)
+                os.replace(tmp_path, file_path)
+            if journal:
+                os.truncate(journal_path, 0)
+                store.journal_size = 0
+            store.file_state = file_state(s_class)
+
+    def save(self, obj: Base):
+        """ Save one object
+        """
+        self.save_many(obj.__class__, [obj])
+
+    def save_many(self, cls, objs: List[Base]):
+        """ Save many objects, with one write of the touched files
+        """
+        shared = shared_enabled()
+        with self._writer_lock, \
+                locked_files(cls.__name__) if shared else nullcontext():
+            self.sync(cls)
+            with STORE_LOCK.writing():
+                store = self._store(cls)
+                for obj in objs:
+                    store.add(obj)
+            self._persist(cls, "save", objs)
+
+    def remove(self, obj: Base):
+        """ Remove one object
+        """
+        cls = obj.__class__
+        shared = shared_enabled()
+        with self._writer_lock, \
+                locked_files(cls.__name__) if shared else nullcontext():
+            self.sync(cls)
+            with STORE_LOCK.writing():
+                if self._store(cls).discard(obj.id) is None:
+                    return
+            self._persist(cls, "remove", [obj])
+
+    def count(self, cls) -> int:
+        """ Count all objects
+        """
+        self.sync(cls)
+        return len(self._store(cls).objs)
+
+    def sorted_ids(self, cls) -> List[str]:
+        """ Return the IDs of all objects in order
+        """
+        self.sync(cls)
+        with STORE_LOCK.reading():
+            return self._store(cls).ids()
+
+    def page(self, cls, limit: int,
+             cursor: str = None) -> Tuple[List[Base], str]:
+        """ Return a page of objects ordered by ID, found by bisecting
+        the sorted IDs
+        """
+        self.sync(cls)
+        with STORE_LOCK.reading():
+            store = self._store(cls)
+            ids = store.ids()
+            position = 0 if cursor is None else bisect_right(ids, cursor)
+            objs = []
+            while position < len(ids) and len(objs) < limit:
+                obj = store.objs.get(ids[position])
+                if obj is not None:
+                    objs.append(obj)
+                position += 1
+        next_cursor = objs[-1].id if objs and position < len(ids) else None
+        return objs, next_cursor
+
+    def get(self, cls, id: str) -> Base:
+        """ Return one object by ID
+
+        A single dict lookup is atomic, so no lock is taken.
+        """
+        self.sync(cls)
+        return self._store(cls).objs.get(id)
+
+    def _index_ids(self, store: ClassStore, attr: str,
+                   conditions: List[tuple]) -> List[str]:
+        """ Return the sorted IDs matching the conditions on an indexed
+        attribute, or None if the index can't answer them
+        """
+        index = store.indexes[attr]
+        op, param = conditions[0]
+        try:
+            if op == "eq":
+                return sorted(index.get(param, ()))
+            if op == "in":
+                ids = set()
+                for value in param:
+                    ids.update(index.get(value, ()))
+                return sorted(ids)
+            keys = store.keys(attr)
+            if keys is None:
+                return None
+            start = 0
+            for op, param in conditions:
+                if op in ("prefix", "gte"):
+                    start = max(start, bisect_left(keys, param))
+                elif op == "gt":
+                    start = max(start, bisect_right(keys, param))
+            ids = []
+            for key in islice(keys, start, None):
+                if not all(QUERY_OPERATORS[op](key, param)
+                           for op, param in conditions):
+                    break
+                ids.extend(index[key])
+            return sorted(ids)
+        except TypeError:
+            return None
+
+    def query(self, cls, where: dict, limit: int = None,
+              offset: int = 0) -> Iterator[Base]:
+        """ Iterate over the objects matching a query
+
+        The compiled plan of the query shape picks the candidates: a
+        secondary index when an indexed attribute is compared, the
+        sorted IDs otherwise. Candidates are then matched one at a time,
+        so no list of every object is built.
+        """
+        shape, params = parse_query(cls, where)
+        index_attr, index_positions, match = compile_query(cls, shape)
+        params = tuple(lookup_set(param) if op == "in" else param
+                       for (_, op), param in zip(shape, params))
+        self.sync(cls)
+        with STORE_LOCK.reading():
+            store = self._store(cls)
+            ids = None
+            if index_attr is not None:
+                ids = self._index_ids(store, index_attr, [
+                    (shape[position][1], params[position])
+                    for position in index_positions])
+            if ids is None:
+                ids = store.ids()
+        matches = (obj for obj in map(store.objs.get, ids)
+                   if obj is not None and match(obj, params))
+        return islice(matches, offset,
+                      None if limit is None else offset + limit)
+
+
+JSON_ENGINE = JSONEngine()
+ENGINES = {"json": JSON_ENGINE}
+
+
+def flush():
+    """ Write the files of every class changed since the last flush, in
+    write-behind mode; also run at exit
+    """
+    JSON_ENGINE.flush()
+
+
+atexit.register(flush)
+
+
+def get_engine():
+    """ Return the storage engine named by DB_ENGINE: "json" (default)
+    or "sqlite"
+    """
+    name = getenv("DB_ENGINE", "json")
+    engine = ENGINES.get(name)
+    if engine is None:
+        if name != "sqlite":
+            raise ValueError("Unknown storage engine: {}".format(name))
+        from models.sqlite_engine import SQLiteEngine
+        engine = ENGINES.setdefault(name, SQLiteEngine())
+    return engine
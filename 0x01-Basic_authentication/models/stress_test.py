@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+""" Stress test of the models store: threads saving, removing and
+reading users at the same time, in each storage mode of JSONEngine
+
+Usage: python3 -m models.stress_test (or pytest models/stress_test.py)
+"""
+from contextlib import contextmanager
+from os import getenv, path
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from models.base import JSON_ENGINE
+from models.user import User
+
+DURATION = float(getenv("STRESS_SECONDS", "2"))
+WRITERS = 4
+READERS = 8
+EMAILS = 50
+MODES = (
+    {},
+    {"DB_JOURNAL": "1", "DB_JOURNAL_COMPACT": "50"},
+    {"DB_SHARDS": "4"},
+    {"DB_WRITE_BEHIND": "1", "DB_FLUSH_THRESHOLD": "20"},
+)
+PROJECT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+@contextmanager
+def store_in_tmp(env: dict):
+    """ Run in an empty directory with the given DB_* variables set
+    """
+    saved_env = {key: os.environ.get(key) for key in env}
+    saved_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        os.environ.update(env)
+        try:
+            User.load_from_file()
+            yield
+        finally:
+            JSON_ENGINE.flush()
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+            os.chdir(saved_dir)
+
+
+def check_store():
+    """ Assert that the indexes, shards and sorted IDs match the objects
+    """
+    store = JSON_ENGINE._store(User)
+    objs = store.objs
+    indexed = {}
+    for email, bucket in store.indexes["email"].items():
+        for obj_id, obj in bucket.items():
+            assert obj.email == email, (obj_id, obj.email, email)
+            indexed[obj_id] = obj
+    assert indexed.keys() == objs.keys(), "email index out of sync"
+    sharded = {}
+    for shard in store.shards:
+        sharded.update(shard)
+    assert sharded.keys() == objs.keys(), "shards out of sync"
+    assert store.ids() == sorted(objs), "sorted IDs out of sync"
+
+
+def run_mixed(duration: float = DURATION) -> int:
+    """ Run writers and readers together, return the number of users
+    """
+    errors = []
+    stop = time.time() + duration
+
+    def writer(seed: int):
+        rng = random.Random(seed)
+        mine = []
+        while time.time() < stop:
+            try:
+                if mine and rng.random() < 0.3:
+                    mine.pop(rng.randrange(len(mine))).remove()
+                elif mine and rng.random() < 0.2:
+                    # update through a copy: readers share the stored one
+                    index = rng.randrange(len(mine))
+                    user = User(id=mine[index].id,
+                                email="e{}@x".format(rng.randrange(EMAILS)))
+                    user.save()
+                    mine[index] = user
+                else:
+                    user = User(email="e{}@x".format(rng.randrange(EMAILS)))
+                    user.save()
+                    mine.append(user)
+            except Exception as e:
+                errors.append(repr(e))
+
+    def reader(seed: int):
+        rng = random.Random(seed)
+        while time.time() < stop:
+            try:
+                email = "e{}@x".format(rng.randrange(EMAILS))
+                for user in User.search({"email": email}):
+                    assert user.email == email
+                for user in User.query({"email": {"prefix": "e1"}},
+                                       limit=20):
+                    assert user.email.startswith("e1")
+                users, cursor = User.page(25)
+                ids = [user.id for user in users]
+                assert ids == sorted(ids)
+                if cursor is not None:
+                    more, _ = User.page(25, cursor)
+                    assert all(user.id > cursor for user in more)
+                User.count()
+                for user in users[:5]:
+                    User.get(user.id)
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=writer, args=(seed,))
+               for seed in range(WRITERS)]
+    threads += [threading.Thread(target=reader, args=(seed,))
+                for seed in range(WRITERS, WRITERS + READERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[:5]
+    check_store()
+    return User.count()
+
+
+def test_mixed_readers_and_writers():
+    """ Every storage mode keeps its indexes and files consistent
+    """
+    for env in MODES:
+        with store_in_tmp(env):
+            count = run_mixed()
+            ids = set(JSON_ENGINE._store(User).objs)
+            JSON_ENGINE.flush()
+            User.load_from_file()
+            check_store()
+            assert set(JSON_ENGINE._store(User).objs) == ids, env
+            assert len(ids) == count
+
+
+def test_reload_while_reading():
+    """ Readers never see a half loaded store while another process'
+    write is being reloaded
+    """
+    with store_in_tmp({"DB_SHARED": "1"}):
+        User.save_many([User(email="u{}@x".format(i))
+                        for i in range(20000)])
+        known = User.sorted_ids()[::1000]
+        count = User.count()
+        subprocess.run([sys.executable, "-c",
+                        "from models.user import User\n"
+                        "User.load_from_file()\n"
+                        "User(email='other@x').save()"],
+                       env=dict(os.environ, PYTHONPATH=PROJECT_DIR),
+                       check=True)
+        bad = []
+        done = threading.Event()
+
+        def reload():
+            User.count()
+            done.set()
+
+        def poll():
+            while not done.is_set():
+                if any(User.get(obj_id) is None for obj_id in known):
+                    bad.append("missing user")
+                if User.count() < count:
+                    bad.append("short count")
+
+        threads = [threading.Thread(target=reload),
+                   threading.Thread(target=poll)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not bad, bad[:5]
+        assert User.count() == count + 1
+        check_store()
+
+
+if __name__ == "__main__":
+    test_mixed_readers_and_writers()
+    print("mixed readers and writers: OK")
+    test_reload_while_reading()
+    print("reload while reading: OK")
@@ -2,6 +2,7 @@
 """ User module
 """
 import hashlib
+from typing import List
 from models.base import Base
 
 
@@ -9,6 +10,10 @@ class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    _attributes = Base._attributes + __slots__
+    _indexes = ('email',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -33,6 +38,13 @@ class User(Base):
         else:
             self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
 
+    @staticmethod
+    def hash_passwords(pwds: List[str]) -> List[str]:
+        """ Encrypt many passwords in SHA256, None for the invalid ones
+        """
+        return [hashlib.sha256(pwd.encode()).hexdigest().lower()
+                if type(pwd) is str else None for pwd in pwds]
+
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
         """
@@ -2,18 +2,58 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
 from models.user import User
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+MAX_BULK_SIZE = 100000
+
+
+def stream_users():
+    """ Yield all User objects as a JSON array, a few users per chunk
+    """
+    separator = "["
+    users, cursor = User.page(STREAM_CHUNK_SIZE)
+    while users:
+        yield separator + ",".join(user.to_json_string() for user in users)
+        separator = ","
+        if cursor is None:
+            break
+        users, cursor = User.page(STREAM_CHUNK_SIZE, cursor)
+    yield "[]\n" if separator == "[" else "]\n"
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - limit (optional): number of users per page, 100 by default
+      - cursor (optional): next_cursor of the previous page
+      - stream (optional): 1 to stream every user as a chunked JSON list
+      - all (optional): 1 to return every user as a JSON list
     Return:
-      - list of all User objects JSON represented
+      - page of User objects JSON represented, and the next_cursor
+      - 400 if the limit is not a positive integer
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    if request.args.get("stream") == "1":
+        return Response(stream_users(), mimetype="application/json")
+    if request.args.get("all") == "1":
+        body = ",".join(user.to_json_string() for user in User.all())
+        return Response("[{}]\n".format(body), mimetype="application/json")
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        return jsonify({'error': "limit must be a positive integer"}), 400
+    users, next_cursor = User.page(min(limit, MAX_PAGE_SIZE),
+                                   request.args.get("cursor"))
+    body = ",".join(user.to_json_string() for user in users)
+    return Response('{{"next_cursor":{},"users":[{}]}}\n'.format(
+        json.dumps(next_cursor), body), mimetype="application/json")
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -93,6 +133,97 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+def parse_bulk_body(body: str) -> list:
+    """ Parse a JSON array, or one JSON object per line (NDJSON); an
+    NDJSON line that is not valid JSON is kept as None
+    """
+    if body.lstrip().startswith("["):
+        items = json.loads(body)
+        if type(items) is not list:
+            raise ValueError("not a JSON array")
+        return items
+    items = []
+    for line in body.splitlines():
+        if line.strip() == "":
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(None)
+    return items
+
+
+@app_views.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/bulk
+    Body: JSON array or NDJSON of objects with
+      - email
+      - password
+      - last_name (optional)
+      - first_name (optional)
+    Return:
+      - counts of created users and errors, and one result per item in
+        order: {"id": ...} or {"error": ...}
+      - 201 if every user was created, 207 if only some were
+      - 400 if no user was created, with the same per-item results
+      - 400 if the body can't be parsed or has too many items
+    """
+    try:
+        items = parse_bulk_body(request.get_data(as_text=True))
+    except ValueError:
+        return jsonify({'error': "Wrong format"}), 400
+    if len(items) > MAX_BULK_SIZE:
+        return jsonify({'error': "too many users, at most {}".format(
+            MAX_BULK_SIZE)}), 400
+
+    results = []
+    valid = []
+    for item in items:
+        error_msg = None
+        if type(item) is not dict:
+            error_msg = "Wrong format"
+        elif item.get("email", "") == "":
+            error_msg = "email missing"
+        elif item.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is None:
+            valid.append(item)
+            results.append(None)
+        else:
+            results.append({'error': error_msg})
+
+    users = []
+    hashes = User.hash_passwords([item.get("password") for item in valid])
+    for item, password in zip(valid, hashes):
+        user = User()
+        user.email = item.get("email")
+        user._password = password
+        user.first_name = item.get("first_name")
+        user.last_name = item.get("last_name")
+        users.append(user)
+    try:
+        User.save_many(users)
+    except Exception as e:
+        error = {'error': "Can't create User: {}".format(e)}
+        results = [error if result is None else result
+                   for result in results]
+        users = []
+
+    created = iter(users)
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = {'id': next(created).id}
+    if not users:
+        status = 400
+    elif len(users) < len(results):
+        status = 207
+    else:
+        status = 201
+    return jsonify({'created': len(users),
+                    'errors': len(results) - len(users),
+                    'results': results}), status
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+""" Rewrite the JSON files of a class with another number of shards
+
+Usage: python3 -m models.migrate_shards <class> <shards>
+"""
+from glob import glob
+from typing import Dict
+import json
+import os
+import sys
+
+from models.base import (iter_json_items, locked_files, shard_of,
+                         shard_path)
+
+
+def read_objects(s_class: str) -> Dict[str, dict]:
+    """ Read every object of a class, whatever the current layout, with
+    the journal applied
+    """
+    objs = {}
+    paths = [".db_{}.json".format(s_class)]
+    paths += sorted(glob(".db_{}.*-of-*.json".format(s_class)))
+    for file_path in paths:
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs.update(iter_json_items(f))
+    journal_path = ".db_{}.journal".format(s_class)
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record.get("op") == "save":
+                    objs[record["obj"]["id"]] = record["obj"]
+                else:
+                    objs.pop(record.get("id"), None)
+    return objs
+
+
+def migrate(s_class: str, count: int) -> int:
+    """ Write the objects of a class into count shards, then remove the
+    files of the previous layout and empty the journal
+    """
+    with locked_files(s_class):
+        objs = read_objects(s_class)
+        shards = [{} for _ in range(count)]
+        for obj_id, obj_json in objs.items():
+            shards[shard_of(obj_id, count)][obj_id] = obj_json
+
+        new_paths = set()
+        for index, objs_json in enumerate(shards):
+            file_path = shard_path(s_class, index, count)
+            tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(objs_json, f)
+            os.replace(tmp_path, file_path)
+            new_paths.add(file_path)
+
+        stale = [".db_{}.json".format(s_class)]
+        stale += glob(".db_{}.*-of-*.json".format(s_class))
+        for file_path in stale:
+            if file_path not in new_paths and os.path.exists(file_path):
+                os.remove(file_path)
+        journal_path = ".db_{}.journal".format(s_class)
+        if os.path.exists(journal_path):
+            os.truncate(journal_path, 0)
+    return len(objs)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: {} <class> <shards>".format(sys.argv[0]))
+        sys.exit(1)
+    shards = max(1, int(sys.argv[2]))
+    total = migrate(sys.argv[1], shards)
+    print("{}: {} objects in {} shard(s)".format(sys.argv[1], total, shards))
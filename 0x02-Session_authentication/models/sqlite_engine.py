@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+""" SQLite storage engine module
+"""
+from datetime import datetime
+from functools import lru_cache
+from typing import TypeVar, List, Iterator, Tuple
+from os import getenv
+import json
+import sqlite3
+import threading
+
+from models.base import TIMESTAMP_FORMAT, parse_query
+
+FETCH_SIZE = 500
+PREDICATES = {
+    "eq": '"{0}" IS ?',
+    "in": '("{0}" IN (SELECT value FROM json_each(?))'
+          ' OR ("{0}" IS NULL AND ?))',
+    "prefix": '("{0}" >= ? AND (? IS NULL OR "{0}" < ?))',
+    "suffix": '(typeof("{0}") = \'text\''
+              ' AND substr("{0}", length("{0}") - ? + 1) = ?)',
+    "gt": '"{0}" > ?',
+    "gte": '"{0}" >= ?',
+    "lt": '"{0}" < ?',
+    "lte": '"{0}" <= ?',
+}
+
+
+def to_sql(value):
+    """ Convert a query parameter to its stored form
+    """
+    if type(value) is datetime:
+        return value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+
+def prefix_end(prefix: str) -> str:
+    """ Return the smallest string greater than every string starting
+    with prefix, or None if there is none
+    """
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            return prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+def bind(op: str, param) -> list:
+    """ Return the SQL parameters of one predicate of PREDICATES
+    """
+    if op == "in":
+        values = [to_sql(value) for value in param]
+        return [json.dumps([value for value in values if value is not None]),
+                None in values]
+    if op == "prefix":
+        end = prefix_end(param)
+        return [param, end, end]
+    if op == "suffix":
+        return [len(param), param]
+    return [to_sql(param)]
+
+
+@lru_cache(maxsize=256)
+def compile_where(shape: tuple) -> str:
+    """ Compile a query shape once into its WHERE clause
+    """
+    return " AND ".join(PREDICATES[op].format(attr) for attr, op in shape)
+
+
+class SQLiteEngine():
+    """ Storage engine persisting each object as one row of an embedded
+    SQLite database: one table per class, one column per attribute and
+    an SQL index for every attribute listed in _indexes
+    """
+
+    def __init__(self):
+        """ Initialize an engine on the file named by DB_SQLITE_PATH
+        """
+        self.path = getenv("DB_SQLITE_PATH", ".db.sqlite3")
+        self._local = threading.local()
+        self._tables = set()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Return the connection of the current thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _table(self, cls) -> str:
+        """ Create the table and indexes of a class once, return its name
+        """
+        s_class = cls.__name__
+        if s_class not in self._tables:
+            columns = ", ".join(
+                '"{}"{}'.format(attr, " PRIMARY KEY" if attr == "id" else "")
+                for attr in cls._attributes)
+            connection = self._connection()
+            connection.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'.format(
+                s_class, columns))
+            for attr in cls._indexes:
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}")'
+                    .format(s_class, attr))
+            self._tables.add(s_class)
+        return s_class
+
+    def _select(self, cls, where: str = "", params: tuple = (),
+                suffix: str = "") -> List[TypeVar('Base')]:
+        """ Run a SELECT on the table of a class and build the objects
+        """
+        sql = 'SELECT {} FROM "{}"'.format(
+            ", ".join('"{}"'.format(attr) for attr in cls._attributes),
+            self._table(cls))
+        if where:
+            sql += " WHERE " + where
+        rows = self._connection().execute(sql + suffix, params).fetchall()
+        return [cls(**dict(zip(cls._attributes, row))) for row in rows]
+
+    def load(self, cls):
+        """ Make sure the table of the class exists; rows are read on
+        demand
+        """
+        self._table(cls)
+
+    def save_all(self, cls, shard: int = None):
+        """ Nothing to do: every save is committed on its own
+        """
+
+    def compact(self, cls):
+        """ Nothing to do: SQLite manages its own write-ahead log
+        """
+
+    def sync(self, cls):
+        """ Nothing to do: every read sees the committed rows of all
+        processes
+        """
+
+    def _insert(self, cls) -> str:
+        """ Return the INSERT OR REPLACE statement of a class
+        """
+        return 'INSERT OR REPLACE INTO "{}" ({}) VALUES ({})'.format(
+            self._table(cls),
+            ", ".join('"{}"'.format(attr) for attr in cls._attributes),
+            ", ".join("?" for _ in cls._attributes))
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or replace the row of one object
+        """
+        cls = obj.__class__
+        values = obj._serialized(True)
+        self._connection().execute(
+            self._insert(cls),
+            [values.get(attr) for attr in cls._attributes])
+
+    def save_many(self, cls, objs: List[TypeVar('Base')]):
+        """ Insert or replace the rows of many objects in one transaction
+        """
+        rows = []
+        for obj in objs:
+            values = obj._serialized(True)
+            rows.append([values.get(attr) for attr in cls._attributes])
+        connection = self._connection()
+        sql = self._insert(cls)
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(sql, rows)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of one object
+        """
+        self._connection().execute(
+            'DELETE FROM "{}" WHERE "id" = ?'.format(
+                self._table(obj.__class__)), (obj.id,))
+
+    def sorted_ids(self, cls) -> List[str]:
+        """ Return the IDs of all objects in order, read from the primary
+        key index
+        """
+        rows = self._connection().execute(
+            'SELECT "id" FROM "{}" ORDER BY "id"'.format(self._table(cls)))
+        return [row[0] for row in rows]
+
+    def count(self, cls) -> int:
+        """ Count all objects
+        """
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM "{}"'.format(self._table(cls))).fetchone()[0]
+
+    def page(self, cls, limit: int,
+             cursor: str = None) -> Tuple[List[TypeVar('Base')], str]:
+        """ Return a page of objects ordered by ID, read from the primary
+        key index
+        """
+        where, params = ('"id" > ?', (cursor,)) if cursor is not None \
+            else ("", ())
+        objs = self._select(cls, where, params,
+                            ' ORDER BY "id" LIMIT {}'.format(limit + 1))
+        if len(objs) > limit:
+            return objs[:limit], objs[limit - 1].id
+        return objs, None
+
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        objs = self._select(cls, '"id" = ?', (id,))
+        return objs[0] if objs else None
+
+    def query(self, cls, where: dict, limit: int = None,
+              offset: int = 0) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the objects matching a query, filtered by SQL so
+        indexed attributes are looked up in their index, and read by
+        batches of FETCH_SIZE rows
+        """
+        shape, params = parse_query(cls, where)
+        sql = 'SELECT {} FROM "{}"'.format(
+            ", ".join('"{}"'.format(attr) for attr in cls._attributes),
+            self._table(cls))
+        values = []
+        if shape:
+            sql += " WHERE " + compile_where(shape)
+            for (_, op), param in zip(shape, params):
+                values.extend(bind(op, param))
+        sql += ' ORDER BY "id" LIMIT ? OFFSET ?'
+        values += [-1 if limit is None else limit, offset]
+        cursor = self._connection().execute(sql, values)
+        return self._iter_rows(cls, cursor)
+
+    def _iter_rows(self, cls, cursor) -> Iterator[TypeVar('Base')]:
+        """ Build the objects of a cursor, FETCH_SIZE rows at a time
+        """
+        rows = cursor.fetchmany(FETCH_SIZE)
+        while rows:
+            for row in rows:
+                yield cls(**dict(zip(cls._attributes, row)))
+            rows = cursor.fetchmany(FETCH_SIZE)